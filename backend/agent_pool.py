@@ -0,0 +1,126 @@
+"""
+Latency-aware load balancing across multiple agent endpoints
+"""
+import random
+import time
+from typing import Dict, List, Optional
+
+# Weight of the newest sample in the latency moving average
+LATENCY_EWMA_ALPHA = 0.3
+# Latency assumed for endpoints that have not been called yet (seconds)
+DEFAULT_LATENCY = 0.5
+# Consecutive failures before an endpoint is ejected
+EJECT_AFTER_FAILURES = 3
+# How long an ejected endpoint is skipped, doubled on each re-ejection (seconds)
+EJECT_BASE_SECONDS = 10.0
+EJECT_MAX_SECONDS = 300.0
+
+
+class Endpoint:
+    """Observed state of a single agent URL"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.latency = DEFAULT_LATENCY
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def score(self) -> float:
+        # Expected wait if we queue one more request behind the outstanding ones
+        return (self.outstanding + 1) * self.latency
+
+
+class AgentPool:
+    """
+    Picks agent endpoints using power-of-two-choices on (outstanding + 1) * latency,
+    and passively ejects endpoints that keep failing.
+    """
+
+    def __init__(self, urls: List[str]):
+        self.endpoints: List[Endpoint] = []
+        self.update_urls(urls)
+
+    def update_urls(self, urls: List[str]):
+        """Replace the endpoint list, keeping observed state for URLs that remain"""
+        existing = {endpoint.url: endpoint for endpoint in self.endpoints}
+        self.endpoints = [existing.get(url) or Endpoint(url) for url in urls]
+
+    def pick(self, exclude: Optional[List[Endpoint]] = None) -> Optional[Endpoint]:
+        """Choose an endpoint for the next request, or None if all are excluded"""
+        candidates = [e for e in self.endpoints if not exclude or e not in exclude]
+        if not candidates:
+            return None
+
+        now = time.monotonic()
+        available = [e for e in candidates if e.is_available(now)]
+        if not available:
+            # Everything is ejected: try the one that comes back soonest rather than giving up
+            return min(candidates, key=lambda e: e.ejected_until)
+
+        if len(available) == 1:
+            return available[0]
+        first, second = random.sample(available, 2)
+        return first if first.score() <= second.score() else second
+
+    def start(self, endpoint: Endpoint) -> float:
+        endpoint.outstanding += 1
+        return time.monotonic()
+
+    def release(self, endpoint: Endpoint):
+        """End a request that was aborted for reasons unrelated to the endpoint"""
+        endpoint.outstanding -= 1
+
+    def record_success(self, endpoint: Endpoint, started_at: float):
+        endpoint.outstanding -= 1
+        elapsed = time.monotonic() - started_at
+        endpoint.latency = LATENCY_EWMA_ALPHA * elapsed + (1 - LATENCY_EWMA_ALPHA) * endpoint.latency
+        endpoint.consecutive_failures = 0
+        endpoint.ejections = 0
+
+    def record_failure(self, endpoint: Endpoint, started_at: float):
+        endpoint.outstanding -= 1
+        elapsed = time.monotonic() - started_at
+        # Failures count as slow so the endpoint loses p2c comparisons until it recovers
+        penalised = max(elapsed, endpoint.latency * 2)
+        endpoint.latency = LATENCY_EWMA_ALPHA * penalised + (1 - LATENCY_EWMA_ALPHA) * endpoint.latency
+        endpoint.consecutive_failures += 1
+
+        if endpoint.consecutive_failures >= EJECT_AFTER_FAILURES:
+            backoff = min(EJECT_BASE_SECONDS * (2 ** endpoint.ejections), EJECT_MAX_SECONDS)
+            endpoint.ejected_until = time.monotonic() + backoff
+            endpoint.ejections += 1
+            endpoint.consecutive_failures = 0
+            print(f"Ejecting agent endpoint {endpoint.url} for {backoff:.0f}s")
+
+
+# One pool per bot, so observed latency survives across webhook calls
+_pools: Dict[str, AgentPool] = {}
+
+
+def get_agent_urls(agent: dict) -> List[str]:
+    """All endpoint URLs configured for an agent row, primary URL first"""
+    urls = [agent["url"]] if agent.get("url") else []
+    for url in agent.get("urls") or []:
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def get_pool(bot_token: str, urls: List[str]) -> AgentPool:
+    pool = _pools.get(bot_token)
+    if pool is None:
+        pool = AgentPool(urls)
+        _pools[bot_token] = pool
+    elif [e.url for e in pool.endpoints] != urls:
+        pool.update_urls(urls)
+    return pool
+
+
+def remove_pool(bot_token: str):
+    """Forget observed endpoint state for a bot, e.g. after its configuration changes"""
+    _pools.pop(bot_token, None)
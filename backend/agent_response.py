@@ -0,0 +1,160 @@
+"""
+Bounded reading and validation of agent responses, and splitting replies to fit Telegram messages
+"""
+import codecs
+import json
+import os
+from typing import AsyncIterator, List, Optional, Tuple
+
+import httpx
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Largest agent response body we are willing to read (bytes)
+AGENT_RESPONSE_MAX_BYTES = int(os.environ.get("AGENT_RESPONSE_MAX_BYTES", str(1024 * 1024)))
+# Telegram rejects sendMessage / editMessageText text longer than this
+TELEGRAM_MESSAGE_LIMIT = 4096
+# How much of an error body is read for logging
+ERROR_PREVIEW_BYTES = 200
+
+
+class AgentResponseError(Exception):
+    """The agent answered, but not with something we can relay"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        # Set when the agent answered with an HTTP error status
+        self.status_code = status_code
+
+
+def loads(data: bytes):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def _check_content_length(response: httpx.Response, max_bytes: int):
+    content_length = response.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise AgentResponseError(f"Agent response of {content_length} bytes exceeds {max_bytes}")
+
+
+async def read_bounded(response: httpx.Response, max_bytes: int = AGENT_RESPONSE_MAX_BYTES) -> bytes:
+    """Read a streamed response body, aborting as soon as it grows past max_bytes"""
+    _check_content_length(response, max_bytes)
+    body = bytearray()
+    async for chunk in response.aiter_bytes():
+        body += chunk
+        if len(body) > max_bytes:
+            raise AgentResponseError(f"Agent response exceeds {max_bytes} bytes")
+    return bytes(body)
+
+
+async def read_preview(response: httpx.Response, max_bytes: int = ERROR_PREVIEW_BYTES) -> str:
+    """The start of a response body, for log messages, without reading the rest"""
+    preview = bytearray()
+    async for chunk in response.aiter_bytes():
+        preview += chunk
+        if len(preview) >= max_bytes:
+            break
+    return preview[:max_bytes].decode("utf-8", "replace")
+
+
+async def iter_bounded_lines(response: httpx.Response, max_bytes: int = AGENT_RESPONSE_MAX_BYTES) -> AsyncIterator[str]:
+    """Yield decoded lines of a streamed body, counting every byte against max_bytes, including unterminated lines"""
+    _check_content_length(response, max_bytes)
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    received = 0
+    pending = ""
+    async for chunk in response.aiter_bytes():
+        received += len(chunk)
+        if received > max_bytes:
+            raise AgentResponseError(f"Agent stream exceeds {max_bytes} bytes")
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+def parse_agent_output(body: bytes) -> str:
+    """Validate a body against the {"output": "<text>"} contract and return the text"""
+    try:
+        agent_data = loads(body)
+    except ValueError:
+        raise AgentResponseError(f"Agent response is not JSON: {body[:ERROR_PREVIEW_BYTES]!r}")
+    if not isinstance(agent_data, dict) or "output" not in agent_data:
+        raise AgentResponseError(f"Agent response missing 'output' field: {body[:ERROR_PREVIEW_BYTES]!r}")
+    return validate_output(agent_data["output"])
+
+
+def validate_output(output) -> str:
+    """Check an agent's output value, from any transport, is text we can send to Telegram"""
+    if not isinstance(output, str) or not output.strip():
+        raise AgentResponseError(f"Agent 'output' must be a non-empty string, got {output!r:.{ERROR_PREVIEW_BYTES}}")
+    return output
+
+
+async def read_agent_output(response: httpx.Response) -> str:
+    """Read and validate a streamed agent response; raises AgentResponseError if it can't be used"""
+    if response.status_code != 200:
+        raise AgentResponseError(
+            f"Agent URL returned {response.status_code}: {await read_preview(response)}", status_code=response.status_code
+        )
+    return parse_agent_output(await read_bounded(response))
+
+
+def utf16_length(text: str) -> int:
+    """Length as Telegram counts it: UTF-16 code units, so characters outside the BMP (e.g. most emoji) count twice"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _fitting_end(text: str, start: int, limit: int) -> int:
+    """End of the longest slice of text from `start` that fits in `limit` UTF-16 code units"""
+    window = text[start:start + limit]
+    if utf16_length(window) <= limit:
+        return start + len(window)
+    # Some characters take two units, so the answer lies between limit // 2 and limit characters
+    fits, too_long = limit // 2, len(window)
+    while too_long - fits > 1:
+        middle = (fits + too_long) // 2
+        if utf16_length(window[:middle]) <= limit:
+            fits = middle
+        else:
+            too_long = middle
+    return start + fits
+
+
+def split_spans(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[Tuple[int, int]]:
+    """
+    (start, end) of each Telegram-sized part of text, preferring paragraph, line and word boundaries.
+    Appending to text never moves the spans before the last one.
+    """
+    spans = []
+    start = 0
+    while True:
+        end = _fitting_end(text, start, limit)
+        if end == len(text):
+            break
+        window = text[start:end]
+        cut, skip = end, 0
+        for separator in ("\n\n", "\n", " "):
+            position = window.rfind(separator)
+            # Don't produce tiny parts just to land on a boundary
+            if position > len(window) // 2:
+                # Only the separator is dropped, so e.g. indentation on the next line survives
+                cut, skip = start + position, len(separator)
+                break
+        spans.append((start, cut))
+        start = cut + skip
+    if text[start:].strip():
+        spans.append((start, len(text)))
+    return spans
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Split text into Telegram-sized parts, preferring paragraph, line and word boundaries"""
+    return [text[start:end] for start, end in split_spans(text, limit)]
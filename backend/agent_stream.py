@@ -0,0 +1,178 @@
+"""
+Streaming agent protocol (SSE or NDJSON) and progressive Telegram message updates
+"""
+import os
+import time
+from typing import AsyncIterator, List, Optional, Tuple
+
+import httpx
+
+from agent_response import iter_bounded_lines, loads, split_spans
+
+# Minimum seconds between editMessageText calls for one message (Telegram throttles faster edits)
+STREAM_EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", "1.0"))
+
+STREAM_CONTENT_TYPES = ("text/event-stream", "application/x-ndjson", "application/jsonl")
+
+
+def is_stream_response(response: httpx.Response) -> bool:
+    content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+    return content_type in STREAM_CONTENT_TYPES
+
+
+def _parse_chunk(payload: str) -> Optional[Tuple[str, str]]:
+    """
+    Turn one event into ("delta", text) or ("output", text).
+    JSON objects may carry {"delta": ...} to append or {"output": ...} to replace; anything else is appended verbatim.
+    """
+    try:
+        data = loads(payload)
+    except ValueError:
+        return ("delta", payload)
+    if isinstance(data, dict):
+        if isinstance(data.get("output"), str):
+            return ("output", data["output"])
+        if isinstance(data.get("delta"), str):
+            return ("delta", data["delta"])
+        return None
+    if isinstance(data, str):
+        return ("delta", data)
+    return None
+
+
+async def iter_stream_chunks(response: httpx.Response) -> AsyncIterator[Tuple[str, str]]:
+    """Yield ("delta", text) or ("output", text) for each chunk the agent sends; the whole stream counts against the size cap"""
+    is_sse = response.headers.get("content-type", "").startswith("text/event-stream")
+    sse_data = []
+
+    async for line in iter_bounded_lines(response):
+        if is_sse:
+            if line.startswith("data:"):
+                sse_data.append(line[5:].lstrip(" "))
+                continue
+            if line or not sse_data:
+                # Comments, event names and ids are not used
+                continue
+            payload = "\n".join(sse_data)
+            sse_data = []
+        else:
+            payload = line.strip()
+            if not payload:
+                continue
+
+        if payload == "[DONE]":
+            return
+        chunk = _parse_chunk(payload)
+        if chunk is not None:
+            yield chunk
+
+    if sse_data and sse_data[0] != "[DONE]":
+        chunk = _parse_chunk("\n".join(sse_data))
+        if chunk is not None:
+            yield chunk
+
+
+class ProgressiveMessage:
+    """
+    A Telegram reply that is sent on the first chunk and edited, at most every STREAM_EDIT_INTERVAL, as more arrive.
+    Once the text outgrows one message, the filled message is completed and the rest continues in a new one.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, bot_token: str, chat_id: int):
+        self.client = client
+        self.bot_token = bot_token
+        self.chat_id = chat_id
+        # (message_id, text currently shown) for each message sent so far
+        self.messages: List[Tuple[int, str]] = []
+        self.last_edit_at = 0.0
+        # Text shown in full messages, which appending can't change, and how many messages that is
+        self._done_pieces: List[str] = []
+        self._done_messages = 0
+        # Text received after that; joined only when shown, so a stream of tiny deltas isn't copied per delta
+        self._tail_pieces: List[str] = []
+
+    @property
+    def started(self) -> bool:
+        return bool(self.messages)
+
+    @property
+    def text(self) -> str:
+        """Everything received so far"""
+        return "".join(self._done_pieces + self._tail_pieces)
+
+    async def add(self, kind: str, value: str):
+        """Take one chunk from iter_stream_chunks: a "delta" is appended, an "output" replaces the text"""
+        if kind == "output":
+            done = "".join(self._done_pieces)
+            if value.startswith(done):
+                self._done_pieces = [done] if done else []
+                self._tail_pieces = [value[len(done):]]
+            else:
+                # Not a continuation of what the full messages show, so any message may change
+                self._done_pieces, self._done_messages = [], 0
+                self._tail_pieces = [value]
+        else:
+            self._tail_pieces.append(value)
+        await self._show(force=False)
+
+    async def finish(self):
+        """Make sure the final text is shown, regardless of the edit rate limit"""
+        await self._show(force=True)
+
+    async def _show(self, force: bool):
+        if not force and self.messages and time.monotonic() - self.last_edit_at < STREAM_EDIT_INTERVAL:
+            # Nothing would be sent, so don't spend time joining or splitting
+            return
+        tail = "".join(self._tail_pieces)
+        self._tail_pieces = [tail]
+        if not tail or tail.isspace():
+            return
+
+        spans = split_spans(tail)
+        done = 0
+        for number, (start, end) in enumerate(spans):
+            index = self._done_messages + number
+            part = tail[start:end]
+            if index >= len(self.messages):
+                if not await self._send(part):
+                    # Keep parts and messages aligned; the next update retries from here
+                    break
+            elif self.messages[index][1] != part:
+                await self._edit(index, part)
+            # Parts before the last are full and stay put as text is appended, once they are shown
+            if number == done and number < len(spans) - 1 and self.messages[index][1] == part:
+                done += 1
+        if done:
+            self._done_pieces.append(tail[:spans[done][0]])
+            self._done_messages += done
+            self._tail_pieces = [tail[spans[done][0]:]]
+
+    async def _call(self, method: str, payload: dict) -> Optional[dict]:
+        """Call the Bot API; failures are logged rather than raised, so they are never blamed on the agent"""
+        try:
+            response = await self.client.post(f"https://api.telegram.org/bot{self.bot_token}/{method}", json=payload)
+            result = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Telegram {method} failed: {e!r}")
+            return None
+        if not result.get("ok"):
+            print(f"Telegram {method} failed: {result.get('description')}")
+            return None
+        return result
+
+    async def _send(self, text: str) -> bool:
+        result = await self._call("sendMessage", {"chat_id": self.chat_id, "text": text})
+        if result is None:
+            return False
+        self.messages.append((result["result"]["message_id"], text))
+        self.last_edit_at = time.monotonic()
+        return True
+
+    async def _edit(self, index: int, text: str):
+        message_id = self.messages[index][0]
+        result = await self._call(
+            "editMessageText", {"chat_id": self.chat_id, "message_id": message_id, "text": text}
+        )
+        self.last_edit_at = time.monotonic()
+        if result is not None:
+            self.messages[index] = (message_id, text)
@@ -0,0 +1,83 @@
+"""
+Persistent WebSocket transport: agents connect out to us and requests are multiplexed by correlation id
+"""
+import asyncio
+import os
+import uuid
+from typing import Dict, List, Optional, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from agent_response import AgentResponseError, validate_output
+
+# Seconds to wait for an agent's reply over its WebSocket
+AGENT_WS_TIMEOUT = float(os.environ.get("AGENT_WS_TIMEOUT", "30"))
+
+
+class AgentConnection:
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.pending: Dict[str, asyncio.Future] = {}
+
+
+class AgentConnectionRegistry:
+    """Open agent WebSockets per bot; a bot may hold several connections (e.g. one per replica)"""
+
+    def __init__(self):
+        self._connections: Dict[str, List[AgentConnection]] = {}
+
+    def has_connection(self, bot_token: str) -> bool:
+        return bool(self._connections.get(bot_token))
+
+    async def serve(self, bot_token: str, websocket: WebSocket):
+        """Run an accepted agent connection until it closes, resolving replies as they arrive"""
+        connection = AgentConnection(websocket)
+        self._connections.setdefault(bot_token, []).append(connection)
+        try:
+            while True:
+                message = await websocket.receive_json()
+                if not isinstance(message, dict):
+                    continue
+                future = connection.pending.pop(str(message.get("id")), None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+        except (WebSocketDisconnect, ValueError) as e:
+            print(f"Agent WebSocket closed: {e!r}")
+        finally:
+            connections = self._connections.get(bot_token, [])
+            if connection in connections:
+                connections.remove(connection)
+            if not connections:
+                self._connections.pop(bot_token, None)
+            for future in connection.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Agent WebSocket closed"))
+
+    async def request(self, bot_token: str, user_input: Union[str, List[str]]) -> Optional[str]:
+        """Send a message over the least busy connection and wait for its output; None if it can't be answered"""
+        connections = self._connections.get(bot_token)
+        if not connections:
+            return None
+        connection = min(connections, key=lambda c: len(c.pending))
+
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        connection.pending[request_id] = future
+        try:
+            await connection.websocket.send_json({"id": request_id, "input": user_input})
+            reply = await asyncio.wait_for(future, timeout=AGENT_WS_TIMEOUT)
+        except Exception as e:
+            print(f"Agent WebSocket request failed: {e!r}")
+            return None
+        finally:
+            connection.pending.pop(request_id, None)
+
+        # Same contract as HTTP replies; a failing reply falls through to the other transports
+        try:
+            return validate_output(reply.get("output"))
+        except AgentResponseError as e:
+            print(f"Agent WebSocket reply unusable: {e}")
+            return None
+
+
+agent_connections = AgentConnectionRegistry()
@@ -0,0 +1,78 @@
+"""
+Debounces bursts of messages from the same chat into a single agent request
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+FlushCallback = Callable[[List[Any]], Awaitable[None]]
+
+
+class _Burst:
+    def __init__(self, flush: FlushCallback, window: float, max_wait: float):
+        self.items: List[Any] = []
+        self.flush = flush
+        self.window = window
+        self.deadline = time.monotonic() + max_wait
+        self.last_item_at = time.monotonic()
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+
+class MessageCoalescer:
+    """
+    Buffers items per key until no new item has arrived for `window` seconds,
+    or `max_wait` seconds have passed since the first one, then flushes them together.
+    """
+
+    def __init__(self):
+        self._bursts: Dict[Tuple, _Burst] = {}
+        # key -> task of the newest burst until it has flushed, so the next burst's reply waits for it
+        self._tails: Dict[Tuple, asyncio.Task] = {}
+
+    def add(self, key: Tuple, item: Any, flush: FlushCallback, window: float, max_wait: float):
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = _Burst(flush, window, max_wait)
+            self._bursts[key] = burst
+            burst.task = asyncio.create_task(self._run(key, burst, self._tails.get(key)))
+            self._tails[key] = burst.task
+        burst.items.append(item)
+        burst.last_item_at = time.monotonic()
+
+    def flush_all(self):
+        """Flush every buffered burst now instead of waiting for its window, e.g. on shutdown"""
+        for burst in self._bursts.values():
+            burst.deadline = 0.0
+            burst.wake.set()
+
+    def is_idle(self) -> bool:
+        return not self._tails
+
+    async def _run(self, key: Tuple, burst: _Burst, previous: Optional[asyncio.Task]):
+        while True:
+            now = time.monotonic()
+            flush_at = min(burst.last_item_at + burst.window, burst.deadline)
+            if now >= flush_at:
+                break
+            try:
+                await asyncio.wait_for(burst.wake.wait(), timeout=flush_at - now)
+            except asyncio.TimeoutError:
+                pass
+
+        # Items arriving from here on start a new burst
+        if self._bursts.get(key) is burst:
+            del self._bursts[key]
+        try:
+            if previous is not None:
+                # The previous burst may still be waiting on the agent; reply after it, not before
+                await asyncio.wait([previous])
+            await burst.flush(burst.items)
+        except Exception as e:
+            print(f"Error flushing coalesced messages: {e}")
+        finally:
+            if self._tails.get(key) is burst.task:
+                del self._tails[key]
+
+
+coalescer = MessageCoalescer()
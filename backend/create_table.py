@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-Create the agents table in Supabase using REST API
+Create the agents and pending_updates tables in Supabase using REST API
 """
 import os
 import requests
@@ -15,15 +15,38 @@ if not supabase_url or not supabase_key:
     print("Error: Supabase credentials not found")
     exit(1)
 
-# SQL to create table
+# SQL to create the tables
 sql = """
 CREATE TABLE IF NOT EXISTS agents (
   id SERIAL PRIMARY KEY,
   url TEXT NOT NULL,
   bot_token TEXT NOT NULL,
   price FLOAT NOT NULL DEFAULT 0.001,
+  urls JSONB NOT NULL DEFAULT '[]',
+  cache_enabled BOOLEAN NOT NULL DEFAULT FALSE,
+  cache_ttl INTEGER NOT NULL DEFAULT 3600,
+  coalesce_window_ms INTEGER NOT NULL DEFAULT 0,
+  coalesce_max_wait_ms INTEGER NOT NULL DEFAULT 3000,
+  coalesce_mode TEXT NOT NULL DEFAULT 'concat',
+  stream BOOLEAN NOT NULL DEFAULT FALSE,
   created_at TIMESTAMP DEFAULT NOW()
 );
+
+CREATE TABLE IF NOT EXISTS pending_updates (
+  id BIGSERIAL PRIMARY KEY,
+  bot_token TEXT NOT NULL,
+  body TEXT NOT NULL,
+  created_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Upgrading an existing agents table
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS urls JSONB NOT NULL DEFAULT '[]';
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS cache_enabled BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS cache_ttl INTEGER NOT NULL DEFAULT 3600;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS coalesce_window_ms INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS coalesce_max_wait_ms INTEGER NOT NULL DEFAULT 3000;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS coalesce_mode TEXT NOT NULL DEFAULT 'concat';
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS stream BOOLEAN NOT NULL DEFAULT FALSE;
 """
 
 # Try to execute SQL via the Supabase REST API
@@ -34,7 +57,7 @@ headers = {
     "Content-Type": "application/json"
 }
 
-print(f"Attempting to create table at {supabase_url}...")
+print(f"Attempting to create tables at {supabase_url}...")
 print("\nNote: If this fails, please run the following SQL in your Supabase dashboard:")
 print("=" * 60)
 print(sql)
@@ -0,0 +1,53 @@
+"""
+Consistent hashing of keys (bot tokens) onto worker nodes
+"""
+import bisect
+import hashlib
+from typing import Dict, List, Optional
+
+# Points per node on the ring; more points give a more even spread
+DEFAULT_VIRTUAL_NODES = 160
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Maps each key to the first node point clockwise from the key's hash.
+    Adding or removing a node only moves the keys on the arcs that node owns.
+    """
+
+    def __init__(self, nodes: Optional[List[str]] = None, virtual_nodes: int = DEFAULT_VIRTUAL_NODES):
+        self.virtual_nodes = virtual_nodes
+        self._points: List[int] = []
+        self._owners: Dict[int, str] = {}
+        self.nodes: List[str] = []
+        for node in nodes or []:
+            self.add_node(node)
+
+    def add_node(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.virtual_nodes):
+            point = _hash(f"{node}#{i}")
+            # Collisions are astronomically unlikely; first owner keeps the point
+            if point in self._owners:
+                continue
+            self._owners[point] = node
+            bisect.insort(self._points, point)
+
+    def remove_node(self, node: str):
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        self._points = [p for p in self._points if self._owners[p] != node]
+        self._owners = {p: owner for p, owner in self._owners.items() if owner != node}
+
+    def get_node(self, key: str) -> Optional[str]:
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
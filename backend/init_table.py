@@ -11,7 +11,7 @@ load_dotenv()
 supabase_url = os.environ.get("SUPABASE_URL")
 supabase_key = os.environ.get("SUPABASE_KEY")
 
-print("Please create the 'agents' table in Supabase:")
+print("Please create the 'agents' and 'pending_updates' tables in Supabase:")
 print("\n1. Go to: https://supabase.com/dashboard/project/mhycwrnqmzpkteewrgok/editor")
 print("2. Click 'SQL Editor' in the left sidebar")
 print("3. Click 'New query'")
@@ -23,9 +23,32 @@ CREATE TABLE IF NOT EXISTS agents (
   url TEXT NOT NULL,
   bot_token TEXT NOT NULL,
   price FLOAT NOT NULL DEFAULT 0.001,
+  urls JSONB NOT NULL DEFAULT '[]',
+  cache_enabled BOOLEAN NOT NULL DEFAULT FALSE,
+  cache_ttl INTEGER NOT NULL DEFAULT 3600,
+  coalesce_window_ms INTEGER NOT NULL DEFAULT 0,
+  coalesce_max_wait_ms INTEGER NOT NULL DEFAULT 3000,
+  coalesce_mode TEXT NOT NULL DEFAULT 'concat',
+  stream BOOLEAN NOT NULL DEFAULT FALSE,
   created_at TIMESTAMP DEFAULT NOW()
 );
+
+CREATE TABLE IF NOT EXISTS pending_updates (
+  id BIGSERIAL PRIMARY KEY,
+  bot_token TEXT NOT NULL,
+  body TEXT NOT NULL,
+  created_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Upgrading an existing agents table
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS urls JSONB NOT NULL DEFAULT '[]';
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS cache_enabled BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS cache_ttl INTEGER NOT NULL DEFAULT 3600;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS coalesce_window_ms INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS coalesce_max_wait_ms INTEGER NOT NULL DEFAULT 3000;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS coalesce_mode TEXT NOT NULL DEFAULT 'concat';
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS stream BOOLEAN NOT NULL DEFAULT FALSE;
 """)
 print("-" * 60)
-print("\n5. After running the SQL, the table will be ready!")
+print("\n5. After running the SQL, the tables will be ready!")
 print("\nOnce you've done this, the backend will be able to save agent configurations.")
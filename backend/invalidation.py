@@ -0,0 +1,188 @@
+"""
+Broadcast of configuration changes to every worker process, so in-process state can be dropped
+"""
+import asyncio
+import json
+import os
+import socket
+import uuid
+from typing import Callable, List
+
+InvalidationHandler = Callable[[str], None]
+
+# Identifies this process so it can ignore its own broadcasts
+WORKER_ID = uuid.uuid4().hex
+
+
+class InvalidationChannel:
+    """
+    Delivers invalidated keys (bot tokens) to subscribers in this process.
+    Subclasses additionally forward them to other workers.
+    """
+
+    def __init__(self):
+        self._handlers: List[InvalidationHandler] = []
+
+    def subscribe(self, handler: InvalidationHandler):
+        self._handlers.append(handler)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, key: str):
+        # Always apply locally first, so this worker never depends on the transport to see its own change
+        self._dispatch(key)
+        try:
+            await self._broadcast(json.dumps({"origin": WORKER_ID, "key": key}))
+        except Exception as e:
+            print(f"Failed to broadcast invalidation: {e}")
+
+    async def _broadcast(self, payload: str):
+        pass
+
+    def _receive(self, payload: str):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if message.get("origin") != WORKER_ID and message.get("key"):
+            self._dispatch(message["key"])
+
+    def _dispatch(self, key: str):
+        for handler in self._handlers:
+            try:
+                handler(key)
+            except Exception as e:
+                print(f"Invalidation handler error: {e}")
+
+
+class LocalChannel(InvalidationChannel):
+    """Single-process deployments: nothing to forward"""
+
+
+class _DatagramReceiver(asyncio.DatagramProtocol):
+    def __init__(self, channel: "UnixSocketChannel"):
+        self.channel = channel
+
+    def datagram_received(self, data: bytes, addr):
+        self.channel._receive(data.decode("utf-8", "replace"))
+
+
+class UnixSocketChannel(InvalidationChannel):
+    """
+    Same-host workers: each binds a Unix datagram socket in a shared directory,
+    and a publish sends one datagram to every other socket found there.
+    """
+
+    def __init__(self, socket_dir: str):
+        super().__init__()
+        self.socket_dir = socket_dir
+        self.path = os.path.join(socket_dir, f"{os.getpid()}-{WORKER_ID[:8]}.sock")
+        self._transport = None
+        self._sender = None
+
+    async def start(self):
+        os.makedirs(self.socket_dir, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _DatagramReceiver(self),
+            local_addr=self.path,
+            family=socket.AF_UNIX
+        )
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+
+    async def stop(self):
+        if self._transport:
+            self._transport.close()
+        if self._sender:
+            self._sender.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    async def _broadcast(self, payload: str):
+        if not self._sender:
+            return
+        data = payload.encode("utf-8")
+        for name in os.listdir(self.socket_dir):
+            path = os.path.join(self.socket_dir, name)
+            if path == self.path or not name.endswith(".sock"):
+                continue
+            try:
+                self._sender.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that exited without cleaning up
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            except BlockingIOError:
+                print(f"Invalidation socket {path} is full, dropping message")
+
+
+class PostgresChannel(InvalidationChannel):
+    """Workers on any host: Postgres LISTEN/NOTIFY on a dedicated connection"""
+
+    def __init__(self, dsn: str, channel_name: str = "laissez_invalidation"):
+        super().__init__()
+        self.dsn = dsn
+        self.channel_name = channel_name
+        self._connection = None
+        self._connect_task = None
+        self._stopping = False
+
+    async def start(self):
+        # Connect in the background so a database outage doesn't block startup
+        self._connect_task = asyncio.get_running_loop().create_task(self._connect())
+
+    async def stop(self):
+        self._stopping = True
+        if self._connect_task and not self._connect_task.done():
+            self._connect_task.cancel()
+        if self._connection:
+            await self._connection.close()
+
+    async def _connect(self):
+        import asyncpg
+
+        delay = 1.0
+        while not self._stopping:
+            try:
+                self._connection = await asyncpg.connect(self.dsn)
+                await self._connection.add_listener(self.channel_name, self._on_notify)
+                self._connection.add_termination_listener(self._on_terminated)
+                return
+            except Exception as e:
+                print(f"Invalidation LISTEN connection failed, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self._receive(payload)
+
+    def _on_terminated(self, connection):
+        if not self._stopping:
+            print("Invalidation LISTEN connection lost, reconnecting")
+            self._connect_task = asyncio.get_running_loop().create_task(self._connect())
+
+    async def _broadcast(self, payload: str):
+        if self._connection and not self._connection.is_closed():
+            await self._connection.execute("SELECT pg_notify($1, $2)", self.channel_name, payload)
+
+
+def create_channel() -> InvalidationChannel:
+    """Build the channel selected by INVALIDATION_CHANNEL (local, unix or postgres)"""
+    kind = os.environ.get("INVALIDATION_CHANNEL", "local").lower()
+    if kind == "unix":
+        return UnixSocketChannel(os.environ.get("INVALIDATION_SOCKET_DIR", "/tmp/laissez-invalidation"))
+    if kind == "postgres":
+        dsn = os.environ.get("DATABASE_URL")
+        if not dsn:
+            raise RuntimeError("INVALIDATION_CHANNEL=postgres requires DATABASE_URL")
+        return PostgresChannel(dsn)
+    return LocalChannel()
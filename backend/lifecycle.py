@@ -0,0 +1,176 @@
+"""
+Graceful drain on shutdown: in-flight accounting, and handing unfinished updates to the next process
+"""
+import asyncio
+import json
+import os
+import signal
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Tuple
+
+# Seconds to let in-flight updates finish after SIGTERM before they are persisted and cancelled
+DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", "20"))
+# Seconds between checks for updates persisted by other (draining) processes
+PENDING_POLL_INTERVAL = float(os.environ.get("PENDING_POLL_INTERVAL", "5"))
+# Local spool used when Supabase isn't configured; only survives restarts on the same host
+DRAIN_SPOOL_DIR = os.environ.get("DRAIN_SPOOL_DIR", "/tmp/laissez-pending")
+
+
+class PendingUpdateStore:
+    """
+    Raw webhook bodies that a process accepted but did not finish.
+    Kept in the Supabase `pending_updates` table when available, otherwise in a local spool directory.
+    """
+
+    def __init__(self, supabase, spool_dir: str = DRAIN_SPOOL_DIR):
+        self.supabase = supabase
+        self.spool_dir = spool_dir
+
+    def save(self, bot_token: str, body: bytes):
+        text = body.decode("utf-8")
+        if self.supabase:
+            self.supabase.table("pending_updates").insert({"bot_token": bot_token, "body": text}).execute()
+            return
+        os.makedirs(self.spool_dir, exist_ok=True)
+        name = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+        temp_path = os.path.join(self.spool_dir, f".{name}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"bot_token": bot_token, "body": text}, f)
+        # Rename so readers never see a half-written file
+        os.rename(temp_path, os.path.join(self.spool_dir, f"{name}.json"))
+
+    def claim(self, limit: int = 100) -> List[Tuple[str, bytes]]:
+        """Take ownership of up to `limit` pending updates, oldest first; each is handed to exactly one process"""
+        if self.supabase:
+            rows = self.supabase.table("pending_updates").select("id").order("id").limit(limit).execute().data
+            claimed = []
+            for row in rows:
+                # Whoever's delete returns the row owns it
+                deleted = self.supabase.table("pending_updates").delete().eq("id", row["id"]).execute().data
+                if deleted:
+                    claimed.append((deleted[0]["bot_token"], deleted[0]["body"].encode("utf-8")))
+            return claimed
+
+        if not os.path.isdir(self.spool_dir):
+            return []
+        claimed = []
+        for name in sorted(n for n in os.listdir(self.spool_dir) if n.endswith(".json"))[:limit]:
+            path = os.path.join(self.spool_dir, name)
+            claimed_path = f"{path}.{os.getpid()}.claimed"
+            try:
+                os.rename(path, claimed_path)
+            except OSError:
+                # Another worker got it first
+                continue
+            try:
+                with open(claimed_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                claimed.append((data["bot_token"], data["body"].encode("utf-8")))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Discarding unreadable pending update {name}: {e}")
+            finally:
+                try:
+                    os.remove(claimed_path)
+                except OSError:
+                    pass
+        return claimed
+
+
+class DrainManager:
+    """Tracks updates being processed so shutdown can wait for them, and persists whatever doesn't finish in time"""
+
+    def __init__(self, store: PendingUpdateStore):
+        self.store = store
+        self.draining = False
+        self._draining_event = asyncio.Event()
+        # When in-flight work is cancelled and persisted; set when draining begins
+        self._deadline = 0.0
+        # task -> (bot_token, raw bodies it is responsible for)
+        self._inflight: Dict[asyncio.Task, Tuple[str, List[bytes]]] = {}
+        self._drain_callbacks: List[Callable[[], None]] = []
+        self._idle_checks: List[Callable[[], bool]] = []
+
+    def on_drain(self, callback: Callable[[], None], is_idle: Callable[[], bool]):
+        """Register a component holding queued work: callback releases it when draining starts, is_idle reports when it's done"""
+        self._drain_callbacks.append(callback)
+        self._idle_checks.append(is_idle)
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def begin(self, timeout: float = DRAIN_TIMEOUT):
+        """Stop taking on new work; called as soon as SIGTERM arrives, which starts the drain deadline"""
+        if self.draining:
+            return
+        self.draining = True
+        self._deadline = time.monotonic() + timeout
+        self._draining_event.set()
+        print(f"Draining: {self.inflight} update(s) in flight")
+        for callback in self._drain_callbacks:
+            callback()
+
+    async def sleep_unless_draining(self, seconds: float):
+        """Sleep, but return as soon as draining starts"""
+        try:
+            await asyncio.wait_for(self._draining_event.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    @asynccontextmanager
+    async def track(self, bot_token: str, bodies: List[bytes]):
+        """Account for the current task processing these updates; if it is cancelled, persist them"""
+        task = asyncio.current_task()
+        self._inflight[task] = (bot_token, bodies)
+        try:
+            yield
+        except asyncio.CancelledError:
+            await self.persist(bot_token, bodies)
+            raise
+        finally:
+            self._inflight.pop(task, None)
+
+    async def persist(self, bot_token: str, bodies: List[bytes]):
+        for body in bodies:
+            try:
+                # The store may block on the network, so keep it off the event loop like claim()
+                await asyncio.to_thread(self.store.save, bot_token, body)
+            except Exception as e:
+                print(f"Failed to persist unfinished update, it will be lost: {e}")
+
+    async def drain(self):
+        """Wait until the deadline set by begin() for in-flight and queued work, then cancel the rest, which persists it"""
+        self.begin()
+        while time.monotonic() < self._deadline and (self._inflight or not all(check() for check in self._idle_checks)):
+            await asyncio.sleep(0.05)
+
+        leftover = list(self._inflight)
+        if leftover:
+            print(f"Drain deadline reached, persisting {len(leftover)} unfinished task(s)")
+            for task in leftover:
+                task.cancel()
+            await asyncio.gather(*leftover, return_exceptions=True)
+        print("Drain complete")
+
+    def install_signal_handlers(self):
+        """
+        Start draining the moment SIGTERM/SIGINT arrives, then defer to the existing handler (uvicorn's),
+        which stops accepting connections and waits for open requests.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            # Signal handlers can only be set from the main thread, e.g. not under a test client
+            return
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(sig)
+            if not callable(previous):
+                continue
+
+            def handler(signum, frame, previous=previous):
+                loop.call_soon_threadsafe(self.begin)
+                previous(signum, frame)
+
+            signal.signal(sig, handler)
@@ -0,0 +1,131 @@
+"""
+Streams photos, voice notes and files from Telegram to agents without buffering them in memory
+"""
+import asyncio
+import os
+from typing import AsyncIterator, Optional
+from urllib.parse import quote
+
+import httpx
+
+from agent_response import read_agent_output
+from telegram_types import Message
+
+# Largest file forwarded to an agent (the Bot API itself won't serve files over 20 MB)
+MEDIA_MAX_BYTES = int(os.environ.get("MEDIA_MAX_BYTES", str(20 * 1024 * 1024)))
+# Media transfers in flight per worker; further ones wait for a slot
+MEDIA_MAX_CONCURRENT = int(os.environ.get("MEDIA_MAX_CONCURRENT", "4"))
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+_media_slots = asyncio.Semaphore(MEDIA_MAX_CONCURRENT)
+
+# Message fields carrying a single file, with the content type to assume when Telegram doesn't give one
+MEDIA_FIELDS = {
+    "voice": "audio/ogg",
+    "audio": "audio/mpeg",
+    "document": "application/octet-stream",
+    "video": "video/mp4",
+    "video_note": "video/mp4",
+    "animation": "video/mp4",
+}
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+class MediaUnavailable(Exception):
+    """Telegram couldn't hand over the file; the agent wasn't at fault"""
+
+
+def extract_media(message: Message) -> Optional[dict]:
+    """Describe the file attached to a Telegram message, or None if there is none"""
+    if message.photo:
+        # Telegram lists every resolution it generated, smallest first
+        photo = message.photo[-1]
+        return {
+            "kind": "photo",
+            "file_id": photo.file_id,
+            "file_size": photo.file_size,
+            "mime_type": "image/jpeg",
+            "file_name": None,
+        }
+    for kind, default_mime in MEDIA_FIELDS.items():
+        item = getattr(message, kind)
+        if item is not None:
+            return {
+                "kind": kind,
+                "file_id": item.file_id,
+                "file_size": item.file_size,
+                "mime_type": item.mime_type or default_mime,
+                "file_name": item.file_name,
+            }
+    return None
+
+
+async def _capped_chunks(download: httpx.Response) -> AsyncIterator[bytes]:
+    received = 0
+    try:
+        async for chunk in download.aiter_bytes(MEDIA_CHUNK_SIZE):
+            received += len(chunk)
+            if received > MEDIA_MAX_BYTES:
+                raise MediaTooLarge(f"File exceeds {MEDIA_MAX_BYTES} bytes")
+            yield chunk
+    except httpx.HTTPError as e:
+        # Surfaces from inside the agent upload, so mark it as the download's fault
+        raise MediaUnavailable(f"File download failed: {e!r}") from e
+
+
+async def post_media_to_agent(bot_token: str, media: dict, agent_url: str, caption: str) -> str:
+    """
+    Resolve the file with getFile and pipe it to the agent as a chunked POST, holding one chunk at a time.
+    Returns the agent's output; raises AgentResponseError if its answer can't be used,
+    and MediaUnavailable or MediaTooLarge if the file never made it to the agent.
+    """
+    if media.get("file_size") and media["file_size"] > MEDIA_MAX_BYTES:
+        raise MediaTooLarge(f"File is {media['file_size']} bytes, limit is {MEDIA_MAX_BYTES}")
+
+    async with _media_slots:
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            try:
+                file_result = (await client.post(
+                    f"https://api.telegram.org/bot{bot_token}/getFile",
+                    json={"file_id": media["file_id"]}
+                )).json()
+            except (httpx.HTTPError, ValueError) as e:
+                raise MediaUnavailable(f"getFile failed: {e!r}") from e
+            if not file_result.get("ok"):
+                raise MediaUnavailable(f"getFile failed: {file_result.get('description')}")
+            file_info = file_result["result"]
+            if (file_info.get("file_size") or 0) > MEDIA_MAX_BYTES:
+                raise MediaTooLarge(f"File is {file_info['file_size']} bytes, limit is {MEDIA_MAX_BYTES}")
+
+            file_url = f"https://api.telegram.org/file/bot{bot_token}/{file_info['file_path']}"
+            try:
+                download = await client.send(client.build_request("GET", file_url), stream=True)
+            except httpx.HTTPError as e:
+                raise MediaUnavailable(f"File download failed: {e!r}") from e
+            try:
+                if download.status_code != 200:
+                    raise MediaUnavailable(f"File download returned {download.status_code}")
+                if int(download.headers.get("content-length") or 0) > MEDIA_MAX_BYTES:
+                    raise MediaTooLarge(f"File exceeds {MEDIA_MAX_BYTES} bytes")
+
+                headers = {
+                    "Content-Type": media["mime_type"],
+                    "X-Laissez-Media-Type": media["kind"],
+                }
+                # Header values must be ASCII, so free text is percent-encoded
+                if media.get("file_name"):
+                    headers["X-Laissez-File-Name"] = quote(media["file_name"])
+                if caption:
+                    headers["X-Laissez-Caption"] = quote(caption)
+
+                request = client.build_request("POST", agent_url, content=_capped_chunks(download), headers=headers)
+                agent_result = await client.send(request, stream=True)
+                try:
+                    return await read_agent_output(agent_result)
+                finally:
+                    await agent_result.aclose()
+            finally:
+                await download.aclose()
@@ -0,0 +1,203 @@
+"""
+Opt-in response cache for agents that return the same output for the same input
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+
+def normalize_input(text: str) -> str:
+    """Case- and whitespace-insensitive form of a message, so trivially different inputs share an entry"""
+    return " ".join(text.split()).casefold()
+
+
+def cache_key(agent_id, text: str) -> str:
+    digest = hashlib.sha256(normalize_input(text).encode("utf-8")).hexdigest()
+    return f"{agent_id}:{digest}"
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def to_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+class ResponseCache:
+    """
+    LRU cache of agent outputs bounded by total bytes, with per-entry TTL.
+    Entries evicted from memory spill to an optional disk directory and are promoted back on hit.
+    Disk entries are indexed in memory, and all file I/O runs on one background thread, in submission order.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.current_bytes = 0
+        self.disk_bytes = 0
+        # key -> (output, expires_at, size)
+        self._entries: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()
+        # key -> (expires_at, size) of files on disk, oldest write first
+        self._disk_index: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+        self._stats: Dict[str, CacheStats] = {}
+        self._disk_executor: Optional[ThreadPoolExecutor] = None
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="response-cache-disk")
+            self._load_disk_index()
+
+    async def get(self, agent_id, text: str) -> Optional[str]:
+        key = cache_key(agent_id, text)
+        stats = self._stats.setdefault(str(agent_id), CacheStats())
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            output, expires_at, size = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                stats.hits += 1
+                stats.bytes_saved += size
+                return output
+            self._remove(key)
+
+        disk_entry = self._disk_index.pop(key, None)
+        if disk_entry is not None:
+            expires_at, size = disk_entry
+            self.disk_bytes -= size
+            # The entry moves back to memory on hit, and expired entries are of no further use
+            if expires_at > now:
+                loop = asyncio.get_running_loop()
+                data = await loop.run_in_executor(self._disk_executor, self._read_and_delete, self._disk_path(key))
+                if data is not None and data.get("expires_at", 0) > time.time():
+                    output = data["output"]
+                    self._put(key, output, data["expires_at"])
+                    stats.hits += 1
+                    stats.bytes_saved += len(output.encode("utf-8"))
+                    return output
+            else:
+                self._disk_executor.submit(self._unlink, self._disk_path(key))
+
+        stats.misses += 1
+        return None
+
+    def set(self, agent_id, text: str, output: str, ttl: float):
+        self._put(cache_key(agent_id, text), output, time.time() + ttl)
+
+    def invalidate_agent(self, agent_id):
+        """Drop every entry belonging to an agent, e.g. after its configuration changes"""
+        prefix = f"{agent_id}:"
+        for key in [k for k in self._entries if k.startswith(prefix)]:
+            self._remove(key)
+        for key in [k for k in self._disk_index if k.startswith(prefix)]:
+            self._remove_disk(key)
+
+    def stats(self) -> Dict[str, dict]:
+        return {agent_id: stats.to_dict() for agent_id, stats in self._stats.items()}
+
+    def _put(self, key: str, output: str, expires_at: float):
+        size = len(output.encode("utf-8"))
+        if size > self.max_bytes:
+            self._spill(key, output, expires_at, size)
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (output, expires_at, size)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            old_key, (old_output, old_expires_at, old_size) = next(iter(self._entries.items()))
+            self._remove(old_key)
+            if old_expires_at > time.time():
+                self._spill(old_key, old_output, old_expires_at, old_size)
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key.replace(":", "_") + ".json")
+
+    def _spill(self, key: str, output: str, expires_at: float, size: int):
+        """Queue an entry for the disk tier, evicting the oldest disk entries to stay under its bound"""
+        if not self.disk_dir or size > self.disk_max_bytes:
+            return
+        if key in self._disk_index:
+            self._remove_disk(key)
+        self._disk_index[key] = (expires_at, size)
+        self.disk_bytes += size
+        self._disk_executor.submit(self._write, self._disk_path(key), output, expires_at)
+        while self.disk_bytes > self.disk_max_bytes:
+            self._remove_disk(next(iter(self._disk_index)))
+
+    def _remove_disk(self, key: str):
+        _, size = self._disk_index.pop(key)
+        self.disk_bytes -= size
+        self._disk_executor.submit(self._unlink, self._disk_path(key))
+
+    def _load_disk_index(self):
+        """Index files left by a previous process, oldest first; their expiry is checked when they are read"""
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            agent_id, _, digest = entry.name[:-len(".json")].rpartition("_")
+            files.append((stat.st_mtime, f"{agent_id}:{digest}", stat.st_size))
+        for _, key, size in sorted(files):
+            self._disk_index[key] = (float("inf"), size)
+            self.disk_bytes += size
+        while self.disk_bytes > self.disk_max_bytes:
+            self._remove_disk(next(iter(self._disk_index)))
+
+    # The methods below run on the disk thread
+
+    @staticmethod
+    def _write(path: str, output: str, expires_at: float):
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"output": output, "expires_at": expires_at}, f)
+        except OSError as e:
+            print(f"Response cache disk write failed: {e}")
+
+    @classmethod
+    def _read_and_delete(cls, path: str) -> Optional[dict]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        finally:
+            cls._unlink(path)
+        return data if isinstance(data, dict) and isinstance(data.get("output"), str) else None
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+response_cache = ResponseCache(
+    max_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+    disk_dir=os.environ.get("RESPONSE_CACHE_DIR") or None,
+    disk_max_bytes=int(os.environ.get("RESPONSE_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024))),
+)
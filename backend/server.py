@@ -1,14 +1,49 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import BaseModel, HttpUrl
 from supabase import create_client, Client
+from typing import List, Optional, Tuple, Union
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
 import httpx
 
+from agent_pool import get_agent_urls, get_pool, remove_pool
+from response_cache import response_cache
+from coalescer import coalescer
+from agent_stream import STREAM_CONTENT_TYPES, ProgressiveMessage, is_stream_response, iter_stream_chunks
+from agent_response import AgentResponseError, orjson, read_agent_output, split_message
+from invalidation import LocalChannel, create_channel
+from agent_ws import agent_connections
+from media_proxy import MEDIA_MAX_BYTES, MediaTooLarge, MediaUnavailable, extract_media, post_media_to_agent
+from telegram_types import decode_update
+from lifecycle import PENDING_POLL_INTERVAL, DrainManager, PendingUpdateStore
+
 load_dotenv()
 
-app = FastAPI()
+# Tells every worker process when an agent's configuration changes
+invalidation_channel = create_channel()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await invalidation_channel.start()
+    drain_manager.install_signal_handlers()
+    replay_task = asyncio.create_task(replay_pending_updates())
+    yield
+    # Let the replay loop finish its current batch rather than cancel it mid-claim and lose the claimed updates
+    drain_manager.begin()
+    await replay_task
+    await drain_manager.drain()
+    await invalidation_channel.stop()
+
+
+# orjson serializes responses several times faster than the stdlib encoder FastAPI uses by default
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse if orjson else JSONResponse)
 
 # CORS Configuration
 app.add_middleware(
@@ -29,10 +64,71 @@ if not supabase_url or not supabase_key:
 else:
     supabase: Client = create_client(supabase_url, supabase_key)
 
+# Accounts for updates being processed, so shutdown can finish or hand them over instead of dropping them
+drain_manager = DrainManager(PendingUpdateStore(supabase))
+drain_manager.on_drain(coalescer.flush_all, coalescer.is_idle)
+
+# Number of distinct agent endpoints tried per message before falling back to the LLM
+AGENT_MAX_ATTEMPTS = int(os.environ.get("AGENT_MAX_ATTEMPTS", "2"))
+
+# How long a worker reuses an agent row before re-reading it; changes are also pushed via invalidation_channel.
+# The local channel tells no other worker, so under several workers only a short TTL bounds how stale they get
+AGENT_CONFIG_TTL = float(
+    os.environ.get("AGENT_CONFIG_TTL", "5" if isinstance(invalidation_channel, LocalChannel) else "300")
+)
+# Bots whose configuration a worker keeps; webhook URLs carry arbitrary tokens, so this must be bounded
+AGENT_CONFIG_CACHE_SIZE = int(os.environ.get("AGENT_CONFIG_CACHE_SIZE", "10000"))
+
+# bot_token -> (agent row or None if not configured, expires_at), least recently used first
+_agent_configs: "OrderedDict[str, Tuple[Optional[dict], float]]" = OrderedDict()
+
+
+def get_agent_config(bot_token: str) -> Optional[dict]:
+    """Look up the agent for a bot, from this worker's cache when fresh"""
+    cached = _agent_configs.get(bot_token)
+    if cached is not None and cached[1] > time.monotonic():
+        _agent_configs.move_to_end(bot_token)
+        return cached[0]
+
+    # Saving a bot inserts a new row, so the newest one holds its current configuration
+    agent_response = (
+        supabase.table("agents").select("*").eq("bot_token", bot_token).order("id", desc=True).limit(1).execute()
+    )
+    agent = agent_response.data[0] if agent_response.data else None
+    _agent_configs[bot_token] = (agent, time.monotonic() + AGENT_CONFIG_TTL)
+    _agent_configs.move_to_end(bot_token)
+    while len(_agent_configs) > AGENT_CONFIG_CACHE_SIZE:
+        _agent_configs.popitem(last=False)
+    return agent
+
+
+def invalidate_agent_state(bot_token: str):
+    """Drop everything this worker derived from a bot's configuration"""
+    cached = _agent_configs.pop(bot_token, None)
+    remove_pool(bot_token)
+    if cached is not None and cached[0] is not None:
+        response_cache.invalidate_agent(cached[0]["id"])
+
+
+invalidation_channel.subscribe(invalidate_agent_state)
+
+
 class AgentConfig(BaseModel):
     url: str
     bot_token: str
     price: float
+    # Additional replicas of the agent; requests are balanced across url + urls
+    urls: List[str] = []
+    # Opt-in caching of outputs by normalized input, for deterministic agents
+    cache_enabled: bool = False
+    cache_ttl: int = 3600
+    # Opt-in debouncing of message bursts from one chat into a single agent request (0 = off)
+    coalesce_window_ms: int = 0
+    coalesce_max_wait_ms: int = 3000
+    # "concat" sends the messages joined by newlines, "list" sends them as a JSON array
+    coalesce_mode: str = "concat"
+    # The agent may stream its output (SSE or NDJSON); the reply is edited in Telegram as chunks arrive
+    stream: bool = False
 
 
 async def setup_telegram_webhook(bot_token: str, webhook_url: str) -> dict:
@@ -62,15 +158,32 @@ async def create_agent_config(config: AgentConfig, request: Request):
         # Validate price minimum
         if config.price < 0.001:
             raise HTTPException(status_code=400, detail="Price must be at least $0.001")
+
+        if config.cache_ttl <= 0:
+            raise HTTPException(status_code=400, detail="Cache TTL must be positive")
+
+        if config.coalesce_window_ms < 0 or config.coalesce_max_wait_ms < config.coalesce_window_ms:
+            raise HTTPException(status_code=400, detail="Coalesce max wait must be at least the coalesce window")
+
+        if config.coalesce_mode not in ("concat", "list"):
+            raise HTTPException(status_code=400, detail="Coalesce mode must be 'concat' or 'list'")
         
         # Insert into Supabase
         data = {
             "url": config.url,
             "bot_token": config.bot_token,
-            "price": config.price
+            "price": config.price,
+            "urls": [u for u in config.urls if u and u != config.url],
+            "cache_enabled": config.cache_enabled,
+            "cache_ttl": config.cache_ttl,
+            "coalesce_window_ms": config.coalesce_window_ms,
+            "coalesce_max_wait_ms": config.coalesce_max_wait_ms,
+            "coalesce_mode": config.coalesce_mode,
+            "stream": config.stream
         }
         
         response = supabase.table("agents").insert(data).execute()
+        await invalidation_channel.publish(config.bot_token)
         
         # Set up Telegram webhook - dynamically detect the public URL
         # Check for proxy headers first (set by Kubernetes ingress / load balancer)
@@ -121,6 +234,12 @@ async def get_agent_configs():
         raise HTTPException(status_code=500, detail=f"Failed to fetch configurations: {str(e)}")
 
 
+@app.get("/api/agents/cache-stats")
+async def get_cache_stats():
+    """Get response cache hit rate and bytes saved per agent id"""
+    return {"success": True, "data": response_cache.stats()}
+
+
 async def get_llm_fallback_response(user_message: str) -> str:
     """Generate fallback response using LLM when agent URL fails"""
     from emergentintegrations.llm.chat import LlmChat, UserMessage
@@ -151,20 +270,280 @@ Be concise, helpful, and empathetic about the service disruption."""
         return "I apologize, but I'm unable to process your request at the moment. Please try again later."
 
 
+async def call_agent(bot_token: str, agent: dict, user_input: Union[str, List[str]]) -> Optional[str]:
+    """
+    Send the message to one of the agent's endpoints and return its output.
+    Tries a second endpoint if the first fails; returns None when the LLM fallback should be used.
+    """
+    urls = get_agent_urls(agent)
+    if not urls:
+        return None
+
+    pool = get_pool(bot_token, urls)
+    tried = []
+    for _ in range(min(AGENT_MAX_ATTEMPTS, len(urls))):
+        endpoint = pool.pick(exclude=tried)
+        if endpoint is None:
+            break
+        tried.append(endpoint)
+
+        started_at = pool.start(endpoint)
+        try:
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                # Streamed so an oversized body is abandoned instead of buffered
+                async with client.stream(
+                    "POST",
+                    endpoint.url,
+                    json={"input": user_input}
+                ) as agent_result:
+                    agent_output = await read_agent_output(agent_result)
+        except AgentResponseError as response_error:
+            # The endpoint is up but answered badly; another replica may do better
+            pool.record_failure(endpoint, started_at)
+            print(f"Agent response error ({endpoint.url}): {response_error}")
+            continue
+        except Exception as proxy_error:
+            # Agent URL failed (timeout, connection error, etc.)
+            pool.record_failure(endpoint, started_at)
+            print(f"Agent URL proxy error ({endpoint.url}): {proxy_error}")
+            continue
+
+        pool.record_success(endpoint, started_at)
+        return agent_output
+
+    return None
+
+
+async def stream_agent_reply(
+    bot_token: str, agent: dict, chat_id: int, user_input: Union[str, List[str]]
+) -> Tuple[Optional[str], bool]:
+    """
+    Call a streaming agent and show its output in the chat while it is being generated.
+    Returns (output, complete): output is None if nothing reached the user and the caller should fall back,
+    and complete is False when the stream broke off after part of the answer was shown.
+    """
+    urls = get_agent_urls(agent)
+    if not urls:
+        return None, False
+
+    pool = get_pool(bot_token, urls)
+    endpoint = pool.pick()
+    started_at = pool.start(endpoint)
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        # Telegram-side failures are logged inside ProgressiveMessage, so anything raised here is the agent's
+        message = ProgressiveMessage(client, bot_token, chat_id)
+        try:
+            async with client.stream(
+                "POST",
+                endpoint.url,
+                json={"input": user_input, "stream": True},
+                headers={"Accept": ", ".join(STREAM_CONTENT_TYPES + ("application/json",))}
+            ) as agent_result:
+                if agent_result.status_code == 200 and is_stream_response(agent_result):
+                    async for kind, value in iter_stream_chunks(agent_result):
+                        await message.add(kind, value)
+                else:
+                    # The agent answered with a plain {"output": ...} body, or an error
+                    await message.add("output", await read_agent_output(agent_result))
+        except Exception as stream_error:
+            pool.record_failure(endpoint, started_at)
+            print(f"Agent stream error ({endpoint.url}): {stream_error}")
+            if not message.started:
+                return None, False
+            # The user has already seen part of the answer, so keep it rather than replacing it with a fallback
+            await message.finish()
+            return message.text, False
+
+        text = message.text
+        if not text.strip():
+            pool.record_failure(endpoint, started_at)
+            print(f"Agent stream from {endpoint.url} produced no output")
+            return None, False
+        pool.record_success(endpoint, started_at)
+        await message.finish()
+        if not message.started:
+            # Telegram refused every streamed send; deliver the finished answer the ordinary way
+            await send_telegram_message(bot_token, chat_id, text)
+    return text, True
+
+
+async def reply_to_message(bot_token: str, agent: dict, chat_id: int, user_input: Union[str, List[str]]):
+    """Answer a message from the agent's response cache, the agent itself, or the LLM fallback"""
+    user_message = user_input if isinstance(user_input, str) else "\n".join(user_input)
+    cache_enabled = bool(agent.get("cache_enabled"))
+    if cache_enabled:
+        cached_output = await response_cache.get(agent["id"], user_message)
+        if cached_output is not None:
+            await send_telegram_message(bot_token, chat_id, cached_output)
+            return
+
+    agent_output = None
+    delivered = False
+    # Only an answer the agent finished is worth caching
+    complete = True
+    if agent_connections.has_connection(bot_token):
+        # The agent holds a persistent WebSocket to us; prefer it over HTTP
+        agent_output = await agent_connections.request(bot_token, user_input)
+    if agent_output is None and agent.get("stream"):
+        # A streamed reply has already been delivered to the user as it arrived
+        agent_output, complete = await stream_agent_reply(bot_token, agent, chat_id, user_input)
+        delivered = agent_output is not None
+    if agent_output is None:
+        agent_output = await call_agent(bot_token, agent, user_input)
+        complete = True
+
+    if agent_output is None:
+        await send_telegram_message(bot_token, chat_id, await get_llm_fallback_response(user_message))
+        return
+
+    if cache_enabled and complete:
+        response_cache.set(agent["id"], user_message, agent_output, agent.get("cache_ttl") or 3600)
+    if not delivered:
+        await send_telegram_message(bot_token, chat_id, agent_output)
+
+
+async def send_telegram_message(bot_token: str, chat_id: int, text: str):
+    """Send a reply to a Telegram chat, split into several messages if it is over Telegram's length limit"""
+    async with httpx.AsyncClient() as client:
+        for part in split_message(text):
+            await client.post(
+                f"https://api.telegram.org/bot{bot_token}/sendMessage",
+                json={
+                    "chat_id": chat_id,
+                    "text": part
+                }
+            )
+
+
+async def reply_to_media(bot_token: str, agent: dict, chat_id: int, media: dict, caption: str):
+    """Stream a photo, voice note or file to one of the agent's endpoints and relay its answer"""
+    urls = get_agent_urls(agent)
+    if not urls:
+        await send_telegram_message(bot_token, chat_id, "This agent can't receive files.")
+        return
+
+    pool = get_pool(bot_token, urls)
+    endpoint = pool.pick()
+    started_at = pool.start(endpoint)
+    try:
+        agent_output = await post_media_to_agent(bot_token, media, endpoint.url, caption)
+    except MediaTooLarge as e:
+        # Not the endpoint's fault, so don't count it against its health
+        pool.release(endpoint)
+        print(f"Media rejected: {e}")
+        await send_telegram_message(
+            bot_token, chat_id, f"That file is too large. The limit is {MEDIA_MAX_BYTES // (1024 * 1024)} MB."
+        )
+        return
+    except MediaUnavailable as e:
+        # Telegram's side failed before the agent was involved
+        pool.release(endpoint)
+        print(f"Media download failed: {e}")
+        await send_telegram_message(bot_token, chat_id, "I couldn't download your file. Please try sending it again.")
+        return
+    except AgentResponseError as response_error:
+        # A 4xx usually means the agent only speaks the JSON contract; that says nothing about its health
+        if response_error.status_code is not None and response_error.status_code >= 500:
+            pool.record_failure(endpoint, started_at)
+        else:
+            pool.release(endpoint)
+        print(f"Agent response error ({endpoint.url}): {response_error}")
+        await send_telegram_message(bot_token, chat_id, "The agent couldn't process your file. Please try again later.")
+        return
+    except httpx.TransportError as proxy_error:
+        pool.record_failure(endpoint, started_at)
+        print(f"Agent media proxy error ({endpoint.url}): {proxy_error!r}")
+        await send_telegram_message(bot_token, chat_id, "I couldn't pass your file to the agent. Please try again later.")
+        return
+    except Exception as proxy_error:
+        pool.release(endpoint)
+        print(f"Agent media proxy error ({endpoint.url}): {proxy_error!r}")
+        await send_telegram_message(bot_token, chat_id, "I couldn't pass your file to the agent. Please try again later.")
+        return
+
+    pool.record_success(endpoint, started_at)
+    await send_telegram_message(bot_token, chat_id, agent_output)
+
+
+def coalesce_message(bot_token: str, agent: dict, chat_id: int, user_message: str, body: bytes):
+    """Buffer a message so a burst from the same chat becomes one agent request and one reply"""
+    as_list = agent.get("coalesce_mode") == "list"
+
+    async def flush(items: List[Tuple[str, bytes]]):
+        messages = [text for text, _ in items]
+        user_input = messages if as_list else "\n".join(messages)
+        # The webhook calls have already returned, so the burst is accounted for here
+        async with drain_manager.track(bot_token, [raw for _, raw in items]):
+            await reply_to_message(bot_token, agent, chat_id, user_input)
+
+    window_ms = agent.get("coalesce_window_ms") or 0
+    max_wait_ms = max(agent.get("coalesce_max_wait_ms") or 0, window_ms)
+    coalescer.add((bot_token, chat_id), (user_message, body), flush, window_ms / 1000, max_wait_ms / 1000)
+
+
+async def process_update(bot_token: str, body: bytes):
+    async with drain_manager.track(bot_token, [body]):
+        await handle_update(bot_token, body)
+
+
+def start_update(bot_token: str, body: bytes):
+    """
+    Process an update in a background task tracked by drain_manager.
+    The webhook answers Telegram once the update is accepted, so a request cancelled during shutdown
+    can never earn a 5xx that makes Telegram redeliver an update we also persisted.
+    """
+    asyncio.create_task(process_update(bot_token, body))
+
+
+async def replay_pending_updates():
+    """Pick up updates persisted by processes that shut down before finishing them, e.g. during a rolling deploy"""
+    while not drain_manager.draining:
+        try:
+            pending = await asyncio.to_thread(drain_manager.store.claim)
+        except Exception as e:
+            print(f"Failed to load pending updates: {e}")
+            pending = []
+        if pending:
+            print(f"Replaying {len(pending)} pending update(s)")
+        for bot_token, body in pending:
+            start_update(bot_token, body)
+        await drain_manager.sleep_unless_draining(PENDING_POLL_INTERVAL)
+
+
 @app.post("/api/telegram-webhook/{bot_token}")
 async def telegram_webhook(bot_token: str, request: Request):
     """
     Receive updates from Telegram and proxy to configured agent URL.
-    Falls back to LLM if agent URL fails.
+    Falls back to LLM if agent URL fails. The update is acknowledged right away and processed in the background.
     """
+    body = await request.body()
+
+    if drain_manager.draining:
+        # Shutting down: hand the update to the next process rather than start work we may not finish
+        try:
+            await asyncio.to_thread(drain_manager.store.save, bot_token, body)
+        except Exception as e:
+            print(f"Failed to persist update while draining: {e}")
+            # Let Telegram redeliver it, hopefully to a process that isn't draining
+            return JSONResponse(status_code=503, content={"ok": False, "error": "Shutting down"})
+        return {"ok": True}
+
+    start_update(bot_token, body)
+    return {"ok": True}
+
+
+async def handle_update(bot_token: str, body: bytes) -> dict:
+    """Process one raw Telegram update, from the webhook or replayed after another process shut down"""
     try:
-        # Parse the incoming update from Telegram
-        update_data = await request.json()
+        # Parse the incoming update from Telegram, decoding only the fields we use
+        update = decode_update(body)
+        message = update.message
+        media = extract_media(message) if message is not None else None
         
         # Check if there's a message with text
-        if "message" in update_data and "text" in update_data["message"]:
-            chat_id = update_data["message"]["chat"]["id"]
-            user_message = update_data["message"]["text"]
+        if message is not None and message.text is not None:
+            chat_id = message.chat.id
+            user_message = message.text
             
             # Get agent configuration from Supabase
             if not supabase:
@@ -172,52 +551,37 @@ async def telegram_webhook(bot_token: str, request: Request):
             else:
                 try:
                     # Query for agent by bot_token
-                    agent_response = supabase.table("agents").select("*").eq("bot_token", bot_token).execute()
-                    
-                    if agent_response.data and len(agent_response.data) > 0:
-                        agent_url = agent_response.data[0]["url"]
-                        
-                        # Try to proxy to agent URL
-                        try:
-                            async with httpx.AsyncClient(timeout=30.0) as client:
-                                agent_result = await client.post(
-                                    agent_url,
-                                    json={"input": user_message}
-                                )
-                                
-                                # Check if response is successful and has output field
-                                if agent_result.status_code == 200:
-                                    agent_data = agent_result.json()
-                                    if "output" in agent_data:
-                                        response_text = agent_data["output"]
-                                    else:
-                                        # Malformed response, use LLM fallback
-                                        print(f"Agent response missing 'output' field: {agent_data}")
-                                        response_text = await get_llm_fallback_response(user_message)
-                                else:
-                                    # Agent URL returned error
-                                    print(f"Agent URL returned {agent_result.status_code}: {agent_result.text[:200]}")
-                                    response_text = await get_llm_fallback_response(user_message)
-                        except Exception as proxy_error:
-                            # Agent URL failed (timeout, connection error, etc.)
-                            print(f"Agent URL proxy error: {proxy_error}")
-                            response_text = await get_llm_fallback_response(user_message)
-                    else:
-                        # Bot token not found in database
-                        response_text = "Configuration not found. Please set up your agent first."
+                    agent = get_agent_config(bot_token)
                 except Exception as db_error:
                     print(f"Database error: {db_error}")
                     response_text = await get_llm_fallback_response(user_message)
+                else:
+                    if agent is not None:
+                        if agent.get("coalesce_window_ms"):
+                            # The reply is sent when the burst is flushed
+                            coalesce_message(bot_token, agent, chat_id, user_message, body)
+                        else:
+                            await reply_to_message(bot_token, agent, chat_id, user_message)
+                        return {"ok": True}
+                    # Bot token not found in database
+                    response_text = "Configuration not found. Please set up your agent first."
             
             # Send reply to Telegram
-            async with httpx.AsyncClient() as client:
-                await client.post(
-                    f"https://api.telegram.org/bot{bot_token}/sendMessage",
-                    json={
-                        "chat_id": chat_id,
-                        "text": response_text
-                    }
-                )
+            await send_telegram_message(bot_token, chat_id, response_text)
+
+        # Photos, voice notes and files are streamed to the agent URL
+        elif media is not None:
+            chat_id = message.chat.id
+            try:
+                agent = get_agent_config(bot_token) if supabase else None
+            except Exception as db_error:
+                print(f"Database error: {db_error}")
+                await send_telegram_message(bot_token, chat_id, "I couldn't look up your agent. Please try again later.")
+            else:
+                if agent is not None:
+                    await reply_to_media(bot_token, agent, chat_id, media, message.caption or "")
+                else:
+                    await send_telegram_message(bot_token, chat_id, "Configuration not found. Please set up your agent first.")
         
         # Always return 200 OK to Telegram
         return {"ok": True}
@@ -228,6 +592,28 @@ async def telegram_webhook(bot_token: str, request: Request):
         return {"ok": False, "error": str(e)}
 
 
+@app.websocket("/api/agent-ws/{bot_token}")
+async def agent_websocket(bot_token: str, websocket: WebSocket):
+    """
+    Persistent connection opened by an agent, e.g. from behind NAT.
+    We send {"id", "input"} frames and the agent answers each with {"id", "output"}.
+    """
+    agent = None
+    if supabase:
+        try:
+            agent = get_agent_config(bot_token)
+        except Exception as db_error:
+            print(f"Database error: {db_error}")
+
+    if agent is None:
+        # Only bots with a saved configuration may attach an agent
+        await websocket.close(code=4404)
+        return
+
+    await websocket.accept()
+    await agent_connections.serve(bot_token, websocket)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-Setup script to create the agents table in Supabase
+Setup script to create the agents and pending_updates tables in Supabase
 """
 from supabase import create_client
 import os
@@ -18,30 +18,56 @@ if not supabase_url or not supabase_key:
 print(f"Connecting to Supabase at {supabase_url}...")
 supabase = create_client(supabase_url, supabase_key)
 
-# SQL to create the agents table
+AGENT_COLUMNS = "id, url, bot_token, price, urls, cache_enabled, cache_ttl, coalesce_window_ms, coalesce_max_wait_ms, coalesce_mode, stream"
+
+# SQL to create the agents and pending_updates tables
 create_table_sql = """
 CREATE TABLE IF NOT EXISTS agents (
   id SERIAL PRIMARY KEY,
   url TEXT NOT NULL,
   bot_token TEXT NOT NULL,
   price FLOAT NOT NULL DEFAULT 0.001,
+  urls JSONB NOT NULL DEFAULT '[]',
+  cache_enabled BOOLEAN NOT NULL DEFAULT FALSE,
+  cache_ttl INTEGER NOT NULL DEFAULT 3600,
+  coalesce_window_ms INTEGER NOT NULL DEFAULT 0,
+  coalesce_max_wait_ms INTEGER NOT NULL DEFAULT 3000,
+  coalesce_mode TEXT NOT NULL DEFAULT 'concat',
+  stream BOOLEAN NOT NULL DEFAULT FALSE,
+  created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS pending_updates (
+  id BIGSERIAL PRIMARY KEY,
+  bot_token TEXT NOT NULL,
+  body TEXT NOT NULL,
   created_at TIMESTAMP DEFAULT NOW()
 );
+
+-- Upgrading an existing agents table
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS urls JSONB NOT NULL DEFAULT '[]';
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS cache_enabled BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS cache_ttl INTEGER NOT NULL DEFAULT 3600;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS coalesce_window_ms INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS coalesce_max_wait_ms INTEGER NOT NULL DEFAULT 3000;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS coalesce_mode TEXT NOT NULL DEFAULT 'concat';
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS stream BOOLEAN NOT NULL DEFAULT FALSE;
 """
 
 try:
     # Execute the SQL using Supabase's RPC function
     # Note: This requires the RPC function to be set up in Supabase
     # Alternatively, we can check if the table exists by trying to query it
-    print("Checking if 'agents' table exists...")
+    print("Checking if the 'agents' and 'pending_updates' tables exist...")
     
     try:
-        # Try to query the table
-        response = supabase.table("agents").select("*").limit(1).execute()
-        print("✓ Table 'agents' already exists!")
+        # Try to query the tables; naming the columns also catches an agents table missing newer ones
+        response = supabase.table("agents").select(AGENT_COLUMNS).limit(1).execute()
+        supabase.table("pending_updates").select("id, bot_token, body").limit(1).execute()
+        print("✓ Tables 'agents' and 'pending_updates' already exist!")
     except Exception as e:
         print(f"Table doesn't exist or error occurred: {str(e)}")
-        print("\nPlease create the table manually in Supabase SQL Editor:")
+        print("\nPlease create or upgrade the tables in Supabase SQL Editor:")
         print("=" * 60)
         print(create_table_sql)
         print("=" * 60)
@@ -49,4 +75,4 @@ try:
 
 except Exception as e:
     print(f"Error: {str(e)}")
-    print("\nPlease create the table manually using the SQL above")
+    print("\nPlease create the tables manually using the SQL above")
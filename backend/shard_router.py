@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Front router for sharded deployments: each bot's webhook traffic goes to one owner worker,
+chosen by consistent hashing of the bot token, so per-bot caches and ordering stay in one process.
+
+Usage:
+    SHARD_WORKER_COUNT=4 python shard_router.py
+        spawns `uvicorn server:app` on ports SHARD_BASE_PORT.. and routes to them
+    SHARD_WORKERS=http://10.0.0.1:8001,http://10.0.0.2:8001 python shard_router.py
+        routes to already running workers
+"""
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+from contextlib import asynccontextmanager
+from typing import List, Optional, Set
+
+import httpx
+import websockets
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect
+
+from hash_ring import HashRing
+
+ROUTER_PORT = int(os.environ.get("SHARD_ROUTER_PORT", "8001"))
+BASE_PORT = int(os.environ.get("SHARD_BASE_PORT", "8101"))
+# How often workers that failed are probed before being put back on the ring (seconds)
+HEALTH_CHECK_INTERVAL = float(os.environ.get("SHARD_HEALTH_CHECK_INTERVAL", "5"))
+# How long to wait for a worker's answer (seconds). A webhook can take several agent attempts plus the LLM
+# fallback, so this must exceed the worker's worst case or the update is reported failed while still being handled
+FORWARD_TIMEOUT = float(os.environ.get("SHARD_FORWARD_TIMEOUT", "300"))
+CONNECT_TIMEOUT = 5.0
+
+# Hop-by-hop headers, plus those httpx recomputes for the forwarded body
+EXCLUDED_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailers",
+    "transfer-encoding", "upgrade", "host", "content-length", "content-encoding",
+}
+
+
+def configured_workers() -> List[str]:
+    workers = os.environ.get("SHARD_WORKERS", "")
+    if workers:
+        return [w.strip().rstrip("/") for w in workers.split(",") if w.strip()]
+    count = int(os.environ.get("SHARD_WORKER_COUNT", str(os.cpu_count() or 1)))
+    return [f"http://127.0.0.1:{BASE_PORT + i}" for i in range(count)]
+
+
+def spawn_workers(workers: List[str]) -> List[subprocess.Popen]:
+    """Start one single-process uvicorn per local worker URL"""
+    processes = []
+    for worker in workers:
+        port = worker.rsplit(":", 1)[1]
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", port],
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ))
+    return processes
+
+
+class ShardRouter:
+    def __init__(self, workers: List[str]):
+        self.workers = workers
+        self.ring = HashRing(workers)
+        self.down: Set[str] = set()
+        self._round_robin = itertools.cycle(workers)
+        self.client: Optional[httpx.AsyncClient] = None
+        self._health_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(FORWARD_TIMEOUT, connect=CONNECT_TIMEOUT))
+        self._health_task = asyncio.create_task(self._probe_down_workers())
+
+    async def stop(self):
+        self._health_task.cancel()
+        await self.client.aclose()
+
+    def owner(self, bot_token: str) -> Optional[str]:
+        return self.ring.get_node(bot_token)
+
+    def any_worker(self) -> Optional[str]:
+        for _ in range(len(self.workers)):
+            worker = next(self._round_robin)
+            if worker not in self.down:
+                return worker
+        return None
+
+    def mark_down(self, worker: str):
+        if worker not in self.down:
+            print(f"Shard worker {worker} unreachable, removing from ring")
+            self.down.add(worker)
+            self.ring.remove_node(worker)
+
+    async def _probe_down_workers(self):
+        while True:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            for worker in list(self.down):
+                try:
+                    response = await self.client.get(f"{worker}/api/health", timeout=2.0)
+                except httpx.HTTPError:
+                    continue
+                if response.status_code == 200:
+                    print(f"Shard worker {worker} is back, adding to ring")
+                    self.down.discard(worker)
+                    self.ring.add_node(worker)
+
+    async def forward(self, request: Request, bot_token: Optional[str] = None) -> Response:
+        body = await request.body()
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in EXCLUDED_HEADERS}
+        # Workers build webhook URLs from these, so keep the public host visible to them
+        headers.setdefault("x-forwarded-host", request.headers.get("host", ""))
+        headers.setdefault("x-forwarded-proto", request.url.scheme)
+
+        # A worker that can't be reached is taken off the ring, so the retry goes to the key's next owner
+        for _ in range(len(self.workers)):
+            worker = self.owner(bot_token) if bot_token else self.any_worker()
+            if worker is None:
+                break
+            try:
+                upstream = await self.client.request(
+                    request.method,
+                    f"{worker}{request.url.path}",
+                    params=request.query_params,
+                    headers=headers,
+                    content=body
+                )
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                # The request never reached the worker, so it is safe to send it elsewhere
+                print(f"Shard forward to {worker} failed: {e!r}")
+                self.mark_down(worker)
+                continue
+            except httpx.TimeoutException as e:
+                # The worker may still be handling it; retrying would run the update (and reply) twice
+                print(f"Shard forward to {worker} timed out: {e!r}")
+                return Response(content=b'{"detail": "Shard worker timed out"}', status_code=504, media_type="application/json")
+            except httpx.TransportError as e:
+                print(f"Shard forward to {worker} broke off: {e!r}")
+                return Response(content=b'{"detail": "Shard worker failed"}', status_code=502, media_type="application/json")
+            response_headers = {k: v for k, v in upstream.headers.items() if k.lower() not in EXCLUDED_HEADERS}
+            return Response(content=upstream.content, status_code=upstream.status_code, headers=response_headers)
+
+        return Response(content=b'{"detail": "No shard worker available"}', status_code=503, media_type="application/json")
+
+
+router = ShardRouter(configured_workers())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await router.start()
+    yield
+    await router.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.api_route("/api/telegram-webhook/{bot_token}", methods=["POST"])
+async def route_webhook(bot_token: str, request: Request):
+    return await router.forward(request, bot_token=bot_token)
+
+
+@app.websocket("/api/agent-ws/{bot_token}")
+async def route_agent_websocket(bot_token: str, websocket: WebSocket):
+    """Agent WebSockets must land on the worker that owns the bot, where its webhook traffic is handled"""
+    worker = router.owner(bot_token)
+    if worker is None:
+        await websocket.close(code=1013)
+        return
+
+    try:
+        upstream = await websockets.connect("ws" + worker[len("http"):] + websocket.url.path)
+    except Exception as e:
+        print(f"Shard WebSocket connect to {worker} failed: {e}")
+        await websocket.close(code=1013)
+        return
+
+    await websocket.accept()
+
+    async def client_to_upstream():
+        while True:
+            await upstream.send(await websocket.receive_text())
+
+    async def upstream_to_client():
+        async for message in upstream:
+            await websocket.send_text(message)
+
+    tasks = [asyncio.create_task(client_to_upstream()), asyncio.create_task(upstream_to_client())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await upstream.close()
+        try:
+            await websocket.close()
+        except (RuntimeError, WebSocketDisconnect):
+            # Already closed by the agent
+            pass
+
+
+@app.api_route("/api/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def route_api(path: str, request: Request):
+    return await router.forward(request)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    processes = [] if os.environ.get("SHARD_WORKERS") else spawn_workers(router.workers)
+    try:
+        uvicorn.run(app, host="0.0.0.0", port=ROUTER_PORT)
+    finally:
+        for process in processes:
+            process.terminate()
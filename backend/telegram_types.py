@@ -0,0 +1,50 @@
+"""
+Typed subset of Telegram's Update, decoded straight from the webhook body.
+Only the fields the proxy reads are declared; msgspec skips everything else without allocating it.
+"""
+from typing import List, Optional
+
+import msgspec
+
+
+# gc=False: these objects hold no reference cycles, so the garbage collector needn't track them
+class PhotoSize(msgspec.Struct, gc=False):
+    file_id: str
+    file_size: Optional[int] = None
+
+
+class File(msgspec.Struct, gc=False):
+    file_id: str
+    file_size: Optional[int] = None
+    mime_type: Optional[str] = None
+    file_name: Optional[str] = None
+
+
+class Chat(msgspec.Struct, gc=False):
+    id: int
+
+
+class Message(msgspec.Struct, gc=False):
+    chat: Chat
+    text: Optional[str] = None
+    caption: Optional[str] = None
+    photo: Optional[List[PhotoSize]] = None
+    voice: Optional[File] = None
+    audio: Optional[File] = None
+    document: Optional[File] = None
+    video: Optional[File] = None
+    video_note: Optional[File] = None
+    animation: Optional[File] = None
+
+
+class Update(msgspec.Struct, gc=False):
+    update_id: int = 0
+    message: Optional[Message] = None
+
+
+_update_decoder = msgspec.json.Decoder(Update)
+
+
+def decode_update(body: bytes) -> Update:
+    """Decode a webhook body; raises msgspec.DecodeError if it isn't a valid Update"""
+    return _update_decoder.decode(body)
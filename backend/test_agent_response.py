@@ -0,0 +1,34 @@
+from agent_response import TELEGRAM_MESSAGE_LIMIT, split_message, utf16_length
+
+
+def test_split_message_keeps_short_text_whole():
+    assert split_message("hello") == ["hello"]
+    assert split_message("") == []
+
+
+def test_split_message_prefers_line_boundaries():
+    text = "a" * 3000 + "\n" + "b" * 3000
+    assert split_message(text) == ["a" * 3000, "b" * 3000]
+
+
+def test_split_message_counts_utf16_code_units():
+    # Each emoji is two UTF-16 code units, which is what Telegram's limit counts
+    parts = split_message("\U0001F600" * 5000)
+    assert all(utf16_length(part) <= TELEGRAM_MESSAGE_LIMIT for part in parts)
+    assert "".join(parts) == "\U0001F600" * 5000
+    assert [len(part) for part in parts] == [2048, 2048, 904]
+
+
+def test_split_message_mixed_text_fits_and_loses_nothing():
+    text = ("word \U0001F680 " * 2000).strip()
+    parts = split_message(text)
+    assert all(utf16_length(part) <= TELEGRAM_MESSAGE_LIMIT for part in parts)
+    assert " ".join(parts) == text
+
+
+def test_split_message_keeps_indentation_after_a_line_break():
+    code = "def f():\n" + "    x = 1\n" * 600
+    parts = split_message(code)
+    assert len(parts) > 1
+    assert all(part.startswith("    x = 1") for part in parts[1:])
+    assert "\n".join(parts) == code
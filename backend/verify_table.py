@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-Verify if the agents table exists in Supabase
+Verify if the agents and pending_updates tables exist in Supabase
 """
 from supabase import create_client
 import os
@@ -18,10 +18,14 @@ if not supabase_url or not supabase_key:
 print(f"Connecting to Supabase at {supabase_url}...")
 supabase = create_client(supabase_url, supabase_key)
 
+# Naming the columns also catches an agents table created before newer ones were added
+AGENT_COLUMNS = "id, url, bot_token, price, urls, cache_enabled, cache_ttl, coalesce_window_ms, coalesce_max_wait_ms, coalesce_mode, stream"
+
 try:
-    # Try to query the table
-    response = supabase.table("agents").select("*").limit(1).execute()
-    print("✓ SUCCESS! Table 'agents' exists and is accessible!")
+    # Try to query the tables
+    response = supabase.table("agents").select(AGENT_COLUMNS).limit(1).execute()
+    supabase.table("pending_updates").select("id, bot_token, body").limit(1).execute()
+    print("✓ SUCCESS! Tables 'agents' and 'pending_updates' exist and are accessible!")
     print(f"  Current records: {len(response.data)}")
     if response.data:
         print("\n  Sample data:")
@@ -29,7 +33,7 @@ try:
             print(f"    - ID: {record.get('id')}, URL: {record.get('url')}, Price: ${record.get('price')}")
 except Exception as e:
     print(f"❌ Table doesn't exist or error occurred: {str(e)}")
-    print("\n📝 Please create the table by running this SQL in Supabase:")
+    print("\n📝 Please create or upgrade the tables by running this SQL in Supabase:")
     print("=" * 70)
     print("""
 CREATE TABLE IF NOT EXISTS agents (
@@ -37,8 +41,31 @@ CREATE TABLE IF NOT EXISTS agents (
   url TEXT NOT NULL,
   bot_token TEXT NOT NULL,
   price FLOAT NOT NULL DEFAULT 0.001,
+  urls JSONB NOT NULL DEFAULT '[]',
+  cache_enabled BOOLEAN NOT NULL DEFAULT FALSE,
+  cache_ttl INTEGER NOT NULL DEFAULT 3600,
+  coalesce_window_ms INTEGER NOT NULL DEFAULT 0,
+  coalesce_max_wait_ms INTEGER NOT NULL DEFAULT 3000,
+  coalesce_mode TEXT NOT NULL DEFAULT 'concat',
+  stream BOOLEAN NOT NULL DEFAULT FALSE,
+  created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS pending_updates (
+  id BIGSERIAL PRIMARY KEY,
+  bot_token TEXT NOT NULL,
+  body TEXT NOT NULL,
   created_at TIMESTAMP DEFAULT NOW()
 );
+
+-- Upgrading an existing agents table
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS urls JSONB NOT NULL DEFAULT '[]';
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS cache_enabled BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS cache_ttl INTEGER NOT NULL DEFAULT 3600;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS coalesce_window_ms INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS coalesce_max_wait_ms INTEGER NOT NULL DEFAULT 3000;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS coalesce_mode TEXT NOT NULL DEFAULT 'concat';
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS stream BOOLEAN NOT NULL DEFAULT FALSE;
 """)
     print("=" * 70)
     print("\nSteps:")